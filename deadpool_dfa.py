@@ -26,10 +26,22 @@ import sys
 import random
 import subprocess
 import struct
+import shutil
 import datetime
-from collections import deque
+from collections import deque, OrderedDict
 import signal
 import time
+import select
+import hashlib
+import re
+import queue
+import threading
+import pickle
+
+# Address ranges recorded in a logfile by dig()
+logranges=re.compile(rb'^Lvl \d+ \[0x([0-9A-Fa-f]+)-0x([0-9A-Fa-f]+)\[', re.M)
+# Same ranges, as recorded in the binary index written next to the logfile
+rangestruct=struct.Struct('<QQ')
 
 def processinput(iblock, blocksize):
     """processinput() helper function
@@ -57,6 +69,14 @@ def processoutput(output, blocksize):
     return int(output, 16)
 
 def try_processoutput(processoutput):
+    if processoutput is globals()['processoutput']:
+        # Default one inlined, saving a call per trial
+        def foo(output, blocksize):
+            try:
+                return int(output, 16)
+            except (TypeError, ValueError):
+                return None
+        return foo
     def foo(output, blocksize):
         try:
             return processoutput(output, blocksize)
@@ -64,6 +84,90 @@ def try_processoutput(processoutput):
             return None
     return foo
 
+def pidfd_usable():
+    # pidfd_open() may be missing or rejected (old kernels, seccomp profiles)
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return False
+    return True
+
+# Minimal replacement of subprocess.Popen for launching the target without shell,
+# based on posix_spawn which avoids duplicating the Python process memory mappings.
+# Only provides what Acquisition.collect() needs, stderr is discarded.
+class SpawnedTarget:
+    def __init__(self, args):
+        self.args=args
+        stdin_r, self.stdin=os.pipe()
+        self.stdout, stdout_w=os.pipe()
+        try:
+            self.pid=os.posix_spawnp(args[0], args, os.environ, file_actions=[
+                (os.POSIX_SPAWN_DUP2, stdin_r, 0),
+                (os.POSIX_SPAWN_DUP2, stdout_w, 1),
+                (os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0)],
+                # Signals ignored by Python, restored as Popen(restore_signals=True) does
+                setsigdef=(signal.SIGPIPE, signal.SIGXFSZ))
+        except OSError:
+            os.close(self.stdin)
+            os.close(self.stdout)
+            raise
+        finally:
+            os.close(stdin_r)
+            os.close(stdout_w)
+        try:
+            self.pidfd=os.pidfd_open(self.pid)
+        except OSError:
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+            os.close(self.stdin)
+            os.close(self.stdout)
+            raise
+        self.output=[]
+        self.returncode=None
+
+    def communicate(self, input=None, timeout=None):
+        if self.stdin is not None:
+            try:
+                if input:
+                    os.write(self.stdin, input)
+            except BrokenPipeError:
+                pass
+            os.close(self.stdin)
+            self.stdin=None
+        deadline=time.time()+timeout
+        while self.stdout is not None:
+            if not select.select([self.stdout], [], [], max(0, deadline-time.time()))[0]:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            chunk=os.read(self.stdout, 65536)
+            if chunk:
+                self.output.append(chunk)
+            else:
+                os.close(self.stdout)
+                self.stdout=None
+        # pidfd gets readable once the process exited
+        if not select.select([self.pidfd], [], [], max(0, deadline-time.time()))[0]:
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        self.wait()
+        return (b''.join(self.output), None)
+
+    def wait(self):
+        if self.returncode is None:
+            self.returncode=os.waitstatus_to_exitcode(os.waitpid(self.pid, 0)[1])
+            for fd in (self.stdin, self.stdout, self.pidfd):
+                if fd is not None:
+                    os.close(fd)
+            self.stdin=self.stdout=self.pidfd=None
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGTERM)
+
+    def kill(self):
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGKILL)
+            self.wait()
+
 class Acquisition:
     def __init__(self, targetbin, targetdata, goldendata, dfa,
                 iblock=0x74657374746573747465737474657374,
@@ -85,7 +189,12 @@ class Acquisition:
                 encrypt=None,
                 outputbeforelastrounds=False,
                 shell=False,
-                debug=False):
+                debug=False,
+                persistent=False,
+                jobs=1,
+                ramdisk=False,
+                targetfct=None,
+                session=False):
         self.debug=debug
         self.verbose=verbose
         self.tolerate_error=tolerate_error
@@ -100,12 +209,20 @@ class Acquisition:
         self.targetdata = targetdata
         # Gold reference, must be different from targetdata
         self.goldendata=open(goldendata, 'rb').read()
+        # Zero-copy view to slice it
+        self.goldenview=memoryview(self.goldendata)
+        # Hashed once, for cache keys of unfaulted runs
+        self.goldendigest=hashlib.blake2b(self.goldendata, digest_size=16).digest()
         # Check function, to validate corrupted outputs
         self.dfa = dfa
         # Block size in bytes AES:16, DES:8
         self.blocksize=dfa.blocksize
         # Enum from dfa class
         self.FaultStatus=dfa.FaultStatus
+        # Classes of FaultStatus, as sorted by dig()
+        self.nofaults={self.FaultStatus.NoFault, self.FaultStatus.MinorFault}
+        self.goodfaults={self.FaultStatus.GoodEncFault, self.FaultStatus.GoodDecFault}
+        self.badfaults={self.FaultStatus.MajorFault, self.FaultStatus.Loop, self.FaultStatus.Crash}
         # Ref iblock
         self.iblock=iblock
         # prepares iblock as list of strings based on its int representation
@@ -132,6 +249,12 @@ class Acquisition:
         # What faults to try once we've a good candidate position?
         # list of values to XOR: [0x01, 0xff, ...], or number of random faults
         self.faults=faults
+        # Random faults, one per xor value
+        self.xorfaults=[('xor', (lambda v: lambda x: x ^ v)(v)) for v in range(256)]
+        # Translation tables of the known faults, to fault whole ranges at once
+        self.faulttables={}
+        for fault in self.xorfaults + (faults if type(faults) is list else []):
+            self.faulttables[fault[1]]=bytes([fault[1](x) for x in range(256)])
         # How many faults per column do we want before stopping?
         self.minfaultspercol=minfaultspercol
         # Timestamp
@@ -143,13 +266,58 @@ class Acquisition:
         # Logfile
         self.logfilename=logfile
         self.logfile=None
+        self.rangesfile=None
+        # Log entries are written by a background thread, in batches.
+        # SimpleQueue.put() is reentrant, as needed by closelog() from the SIGINT handler
+        self.logqueue=queue.SimpleQueue()
+        self.logthread=None
         self.lastroundkeys=[]
+        # Python function to call in-process instead of running targetbin, see README
+        self.targetfct=targetfct
+        # Are we faulting the executable itself?
+        self.faultexec=targetfct is None and os.path.normpath(self.targetbin) == os.path.normpath(self.targetdata)
+        # Is targetdata code (the executable itself, a library...)? It can't be kept open for writing
+        # while being executed (ETXTBSY) nor be moved as it may depend on its location
+        self.iscode=self.faultexec or self.goldendata[:4] == b'\x7fELF' or (targetdata is not None and os.access(targetdata, os.X_OK))
+        # Work copy of the golden data, for code being rewritten entirely or for targetfct
+        self.scratch=bytearray(self.goldendata) if self.iscode or targetfct is not None else None
+        # Keep one target process alive and feed it one request per line?
+        # Only possible when the target reloads targetdata on each request
+        # and if we don't need bash to launch it
+        self.persistent=persistent and not tolerate_error and not shell and not self.faultexec and targetfct is None
+        self.worker=None
+        # Launch plain targets with posix_spawn, else with subprocess.Popen
+        self.spawn=pidfd_usable()
+        # How many faulted copies to run concurrently?
+        # The executable itself is copied under other names, a separate table file is copied
+        # in private working directories so it must be a plain file of the current directory
+        if self.persistent or targetfct is not None or not (self.faultexec or os.path.dirname(os.path.normpath(self.targetdata)) == ''):
+            jobs=1
+        self.jobs=jobs
+        # File descriptors of targetdata and its copies when patched in place, see opentargetdata()
+        self.targetfds=[]
+        # Place a separate table file in RAM? Code stays in place, /dev/shm being often mounted noexec
+        self.ramdir=None
+        if ramdisk and targetfct is None and not self.iscode and os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            self.ramdir='/dev/shm'
+        self.ramfiles=[]
+        # Results of already tried faulted tables, to avoid running identical trials again
+        self.doitcache=OrderedDict()
+        self.doitcachesize=100000
+        # Save progress to resume the same acquisition later, see sessionkey()
+        self.session=session
+        self.sessionfile=None
+        self.sessionsaved=0
+        # Top-level ranges being faulted and tabletree length once they got popped, see interruptsession()
+        self.inflight=None
         def sigint_handler(signal, frame):
             print('\nGot interrupted!')
+            self.stopworker()
+            if self.sessionfile is not None:
+                self.interruptsession()
             self.savetraces()
-            os.remove(self.targetdata)
-            if self.logfile is not None:
-                self.logfile.close()
+            self.removetargetdata()
+            self.closelog()
             sys.exit(0)
         def sigusr1_handler(signal, frame):
             self.savetraces()
@@ -180,8 +348,7 @@ class Acquisition:
                 tracefile='dfa_%s_%s-%s_%i.txt' % (mode, self.inittimestamp, datetime.datetime.now().strftime('%H%M%S'), len(goodpairs))
                 print('Saving %i traces in %s' % (len(goodpairs), tracefile))
                 with open(tracefile, 'wb') as f:
-                    for (iblock, oblock) in goodpairs:
-                        f.write(('%0*X %0*X\n' % (2*self.blocksize, iblock, 2*self.blocksize, oblock)).encode('utf8'))
+                    f.write(''.join(['%0*X %0*X\n' % (2*self.blocksize, iblock, 2*self.blocksize, oblock) for (iblock, oblock) in goodpairs]).encode('utf8'))
                 tracefiles[mode=="dec"].append(tracefile)
         return tracefiles
 
@@ -191,58 +358,297 @@ class Acquisition:
             if len(goodpairs) > 1:
                 trsfile='trs_%s_%s-%s_%i.trs' % (mode, self.inittimestamp, datetime.datetime.now().strftime('%H%M%S'), len(goodpairs))
                 print('Saving %i traces in %s' % (len(goodpairs), trsfile))
-                with open(trsfile, 'wb') as trs:
+                bs=self.blocksize
+                header=b''.join((
                     # Nr of traces
-                    trs.write(b'\x41\x04' + struct.pack('<I', len(goodpairs)))
+                    b'\x41\x04' + struct.pack('<I', len(goodpairs)),
                     # Nr of samples
-                    trs.write(b'\x42\x04' + struct.pack('<I', 0))
+                    b'\x42\x04' + struct.pack('<I', 0),
                     # Sample Coding
-                    trs.write(b'\x43\x01\x01')
+                    b'\x43\x01\x01',
                     # Length of crypto data
-                    trs.write(b'\x44\x02' + struct.pack('<H', 2*self.blocksize))
+                    b'\x44\x02' + struct.pack('<H', 2*bs),
                     # End of header
-                    trs.write(b'\x5F\x00')
-                    for (iblock, oblock) in goodpairs:
-                        # crypto data
-                        trs.write(iblock.to_bytes(self.blocksize,'big')+oblock.to_bytes(self.blocksize,'big'))
+                    b'\x5F\x00'))
+                # Whole file built in place in a single buffer
+                buf=bytearray(len(header)+2*bs*len(goodpairs))
+                buf[:len(header)]=header
+                offset=len(header)
+                # crypto data
+                for iblock, oblock in goodpairs:
+                    buf[offset:offset+bs]=iblock.to_bytes(bs,'big')
+                    buf[offset+bs:offset+2*bs]=oblock.to_bytes(bs,'big')
+                    offset+=2*bs
+                with open(trsfile, 'wb') as trs:
+                    trs.write(buf)
                 tracefiles[mode=="dec"].append(trsfile)
         return tracefiles
 
     def doit(self, table, processed_input, protect=True, init=False, lastroundkeys=None):
+        if lastroundkeys is None:
+            lastroundkeys=self.lastroundkeys
+        # Golden run initializes the dfa module so it must always be executed
+        key=None if init else self.cachekey(table, processed_input, lastroundkeys)
+        if key in self.doitcache:
+            self.doitcache.move_to_end(key)
+            return self.doitcache[key]
+        if self.targetfct is not None:
+            output, status=self.execute(processed_input, table)
+        elif not self.targetfds:
+            self.writetable(self.targetdata, table)
+            output, status=self.execute(processed_input)
+        elif table is self.goldendata:
+            output, status=self.execute(processed_input)
+        else:
+            os.pwrite(self.targetfds[0], table, 0)
+            output, status=self.execute(processed_input)
+            os.pwrite(self.targetfds[0], self.goldendata, 0)
+        if output is None:
+            if status is None:
+                # Could not launch the target (e.g. EAGAIN under load), not cached to retry it later
+                return (None, self.FaultStatus.Crash, None)
+            result=(None, status, None)
+        else:
+            result=self.checkoutput(output, protect, init, lastroundkeys)
+        if key is not None:
+            self.storecache(key, result)
+        return result
+
+    def doit_range(self, r, faultfct, processed_input):
+        # Same as doit(inject(r, faultfct)) but only writing the faulted range when possible
+        key=self.rangekey(r, faultfct, processed_input)
+        if key in self.doitcache:
+            self.doitcache.move_to_end(key)
+            return self.doitcache[key]
+        self.patch(0, r, faultfct)
+        output, status=self.execute(processed_input)
+        self.unpatch(0, r)
+        if output is None:
+            if status is None:
+                return (None, self.FaultStatus.Crash, None)
+            result=(None, status, None)
+        else:
+            result=self.checkoutput(output, True, False, self.lastroundkeys)
+        self.storecache(key, result)
+        return result
+
+    def execute(self, processed_input, table=None):
+        # Returns (output, None), (None, FaultStatus) if the target crashed or hung
+        # or (None, None) if it could not be launched
+        if self.targetfct is not None:
+            try:
+                return (self.targetfct(self.scratch if table is None else table, processed_input), None)
+            except Exception:
+                return (None, self.FaultStatus.Crash)
         input_stdin, input_args = processed_input
         if input_stdin is None:
             input_stdin=b''
         if input_args is None:
             input_args=[]
-        if lastroundkeys is None:
-            lastroundkeys=self.lastroundkeys
-        # To avoid seldom busy file errors:
-        if os.path.isfile(self.targetdata):
-            os.remove(self.targetdata)
-        open(self.targetdata, 'wb').write(table)
-        if os.path.normpath(self.targetbin) == os.path.normpath(self.targetdata):
-            os.chmod(self.targetbin,0o755)
         if self.debug:
             print('echo -n "'+input_stdin.hex()+'"|xxd -r -p|'+' '.join([self.targetbin] + input_args))
+        if self.persistent:
+            return self.doit_worker(input_stdin if input_stdin else (' '.join(input_args)+'\n').encode())
         try:
-            if self.tolerate_error:
-                proc = subprocess.Popen(' '.join([self.targetbin] + input_args) + '; exit 0', stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, executable='/bin/bash')
-            elif self.shell:
-                proc = subprocess.Popen(' '.join([self.targetbin] + input_args), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, executable='/bin/bash')
-            else:
-                proc = subprocess.Popen([self.targetbin] + input_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            output, errs = proc.communicate(input=input_stdin, timeout=self.timeout)
+            proc=self.launch(self.targetbin, input_args)
         except OSError:
-            return (None, self.FaultStatus.Crash, None)
+            return (None, None)
+        try:
+            return self.collect(proc, input_stdin, self.timeout)
+        except OSError:
+            # Reaps the target and closes its fds, SpawnedTarget having no finalizer
+            proc.kill()
+            proc.wait()
+            return (None, None)
+
+    def cachekey(self, table, processed_input, lastroundkeys):
+        h=hashlib.blake2b(self.goldendigest if table is self.goldendata else table, digest_size=16)
+        h.update(repr((processed_input, self.encrypt)).encode())
+        for k in lastroundkeys:
+            h.update(k)
+        return h.digest()
+
+    def rangekey(self, r, faultfct, processed_input):
+        return self.cachekey(struct.pack('<QQ', r[0], r[1])+self.faulttable(faultfct), processed_input, self.lastroundkeys)
+
+    def storecache(self, key, result):
+        # Timeouts may be due to a loaded host, better retry them
+        if result[1] is self.FaultStatus.Loop:
+            return
+        self.doitcache[key]=result
+        if len(self.doitcache) > self.doitcachesize:
+            self.doitcache.popitem(last=False)
+
+    def doit_batch(self, faults, processed_input):
+        # Same as doit_range() for a list of (range, fault function), running one job per fault concurrently
+        input_stdin, input_args = processed_input
+        if input_stdin is None:
+            input_stdin=b''
+        if input_args is None:
+            input_args=[]
+        keys=[self.rangekey(r, faultfct, processed_input) for r, faultfct in faults]
+        procs=[]
+        for k, (r, faultfct) in enumerate(faults):
+            if keys[k] in self.doitcache:
+                self.doitcache.move_to_end(keys[k])
+                procs.append(None)
+                continue
+            self.patch(k, r, faultfct)
+            try:
+                procs.append(self.launch(self.jobbin(k), input_args, self.jobdir(k)))
+            except OSError:
+                procs.append(None)
+        # Jobs compete for CPUs, scale timeout accordingly
+        timeout=self.timeout*max(1, -(-len(faults)//(os.cpu_count() or 1)))
+        results=[]
+        for k, (key, proc) in enumerate(zip(keys, procs)):
+            if proc is None and key in self.doitcache:
+                results.append(self.doitcache[key])
+                continue
+            output, status=(None, None)
+            if proc is not None:
+                try:
+                    output, status=self.collect(proc, input_stdin, timeout)
+                except OSError:
+                    proc.kill()
+                    proc.wait()
+            self.unpatch(k, faults[k][0])
+            if output is None and status is None:
+                # Could not launch this job, not cached to retry it later
+                results.append((None, self.FaultStatus.Crash, None))
+                continue
+            if output is None:
+                results.append((None, status, None))
+            else:
+                results.append(self.checkoutput(output, True, False, self.lastroundkeys))
+            self.storecache(key, results[-1])
+        return results
+
+    def jobdir(self, k):
+        # Private working directory of the k-th job when faulting a separate table file
+        if k == 0 or self.faultexec:
+            return None
+        return '%s.job%i' % (os.path.normpath(self.targetdata), k)
+
+    def jobdata(self, k):
+        if self.faultexec:
+            return self.targetdata if k == 0 else '%s.%i' % (self.targetdata, k)
+        return self.targetdata if k == 0 else os.path.join(self.jobdir(k), os.path.normpath(self.targetdata))
+
+    def jobbin(self, k):
+        if self.faultexec:
+            return self.targetbin if k == 0 else '%s.%i' % (self.targetbin, k)
+        # Jobs run from their own directory
+        return self.targetbin if k == 0 or os.sep not in self.targetbin else os.path.abspath(self.targetbin)
+
+    def patch(self, k, r, faultfct):
+        if self.targetfct is not None:
+            self.scratch[r[0]:r[1]]=self.goldendata[r[0]:r[1]].translate(self.faulttable(faultfct))
+        elif self.targetfds:
+            os.pwrite(self.targetfds[k], self.goldendata[r[0]:r[1]].translate(self.faulttable(faultfct)), r[0])
+        else:
+            # Fault a reusable copy of the golden data rather than building a new one each time
+            self.scratch[r[0]:r[1]]=self.goldendata[r[0]:r[1]].translate(self.faulttable(faultfct))
+            self.writetable(self.jobdata(k), self.scratch)
+            self.scratch[r[0]:r[1]]=self.goldenview[r[0]:r[1]]
+
+    def unpatch(self, k, r):
+        if self.targetfct is not None:
+            self.scratch[r[0]:r[1]]=self.goldenview[r[0]:r[1]]
+        elif self.targetfds:
+            os.pwrite(self.targetfds[k], self.goldenview[r[0]:r[1]], r[0])
+
+    def writetable(self, path, table):
+        # To avoid seldom busy file errors:
+        if os.path.isfile(path):
+            os.remove(path)
+        open(path, 'wb').write(table)
+        if self.iscode:
+            os.chmod(path,0o755)
+
+    def opentargetdata(self):
+        # A separate table file is kept open with its golden content and only faulted ranges get rewritten,
+        # each extra job getting its own copy in a private working directory.
+        # Code is rewritten from scratch each time to avoid busy file errors
+        if self.targetfds or self.faultexec or self.targetfct is not None:
+            return
+        for k in range(self.jobs):
+            if k > 0:
+                self.makejobdir(k)
+            if self.iscode:
+                continue
+            path=self.jobdata(k)
+            if self.ramdir is not None:
+                # Faults never reach the disk, targetdata being a symlink to a RAM-backed copy
+                ramfile=os.path.join(self.ramdir, 'deadpool_dfa_%i_%i' % (os.getpid(), k))
+                try:
+                    self.writetable(ramfile, self.goldendata)
+                    fd=os.open(ramfile, os.O_RDWR)
+                except OSError:
+                    # E.g. /dev/shm is full, keep this copy and the next ones on disk
+                    if os.path.isfile(ramfile):
+                        os.remove(ramfile)
+                    self.ramdir=None
+                else:
+                    if os.path.lexists(path):
+                        os.remove(path)
+                    os.symlink(ramfile, path)
+                    self.ramfiles.append(ramfile)
+                    self.targetfds.append(fd)
+                    continue
+            self.writetable(path, self.goldendata)
+            self.targetfds.append(os.open(path, os.O_RDWR))
+
+    def makejobdir(self, k):
+        os.makedirs(self.jobdir(k), exist_ok=True)
+        # Make the rest of the current directory available to the job
+        for entry in os.listdir('.'):
+            link=os.path.join(self.jobdir(k), entry)
+            if entry != os.path.normpath(self.targetdata) and not entry.startswith(os.path.normpath(self.targetdata)+'.job') and not os.path.lexists(link):
+                os.symlink(os.path.abspath(entry), link)
+
+    def removetargetdata(self):
+        if self.targetfct is not None:
+            return
+        for fd in self.targetfds:
+            os.close(fd)
+        self.targetfds=[]
+        for k in range(self.jobs):
+            if os.path.lexists(self.jobdata(k)):
+                os.remove(self.jobdata(k))
+            if self.jobdir(k) is not None and os.path.isdir(self.jobdir(k)):
+                shutil.rmtree(self.jobdir(k))
+        for ramfile in self.ramfiles:
+            if os.path.isfile(ramfile):
+                os.remove(ramfile)
+        self.ramfiles=[]
+
+    def launch(self, targetbin, input_args, cwd=None):
+        if self.tolerate_error:
+            return subprocess.Popen(' '.join([targetbin] + input_args) + '; exit 0', stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, executable='/bin/bash', cwd=cwd)
+        elif self.shell:
+            return subprocess.Popen(' '.join([targetbin] + input_args), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, executable='/bin/bash', cwd=cwd)
+        elif cwd is None and self.spawn:
+            return SpawnedTarget([targetbin] + input_args)
+        else:
+            return subprocess.Popen([targetbin] + input_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+
+    def collect(self, proc, input_stdin, timeout):
+        # Returns (output, None) or (None, FaultStatus.Loop) if the target had to be killed
+        try:
+            output, errs = proc.communicate(input=input_stdin, timeout=timeout)
         except subprocess.TimeoutExpired:
             proc.terminate()
             try:
-                proc.communicate(timeout=self.timeout)
+                proc.communicate(timeout=timeout)
             except subprocess.TimeoutExpired:
                 proc.kill()
             except:
                 pass
-            return (None, self.FaultStatus.Loop, None)
+            return (None, self.FaultStatus.Loop)
+        return (output, None)
+
+    def checkoutput(self, output, protect, init, lastroundkeys):
         if self.debug:
             print(output)
         if protect:
@@ -264,22 +670,181 @@ class Acquisition:
             oblock = self.dfa.bytes2int(oblock)
         return (oblock, status, index)
 
+    def doit_worker(self, request):
+        # Returns (output, None) or (None, FaultStatus) if the worker died or hung
+        if self.worker is None or self.worker.poll() is not None:
+            self.worker=subprocess.Popen([self.targetbin], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        try:
+            self.worker.stdin.write(request)
+        except OSError:
+            self.stopworker()
+            return (None, self.FaultStatus.Crash)
+        fd=self.worker.stdout.fileno()
+        deadline=time.time()+self.timeout
+        output=b''
+        while not output.endswith(b'\n'):
+            if not select.select([fd], [], [], max(0, deadline-time.time()))[0]:
+                self.stopworker()
+                return (None, self.FaultStatus.Loop)
+            chunk=os.read(fd, 4096)
+            if not chunk:
+                self.stopworker()
+                return (None, self.FaultStatus.Crash)
+            output+=chunk
+        return (output, None)
+
+    def openlog(self, withranges=False, append=False):
+        mode='a' if append else 'w'
+        if self.logfilename is None:
+            self.logfile=open('%s_%s.log' % (self.targetbin if self.targetbin is not None else 'dfa', self.inittimestamp), mode)
+        else:
+            self.logfile=open(self.logfilename, mode)
+        if withranges:
+            self.rangesfile=open(self.logfile.name+'.bin', mode+'b')
+        self.logthread=threading.Thread(target=self.logworker, daemon=True)
+        self.logthread.start()
+
+    def log(self, txt, r=None):
+        self.logqueue.put((txt+'\n', b'' if r is None else rangestruct.pack(*r)))
+
+    def logworker(self):
+        # Batches up to 64 entries or 100ms, a None entry flushes and stops
+        while True:
+            batch=[self.logqueue.get()]
+            deadline=time.time()+0.1
+            while batch[-1] is not None and len(batch)<64:
+                try:
+                    batch.append(self.logqueue.get(timeout=max(0, deadline-time.time())))
+                except queue.Empty:
+                    break
+            done=batch[-1] is None
+            if done:
+                batch.pop()
+            self.logfile.write(''.join([txt for txt,_ in batch]))
+            self.logfile.flush()
+            if self.rangesfile is not None:
+                self.rangesfile.write(b''.join([rb for _,rb in batch]))
+                self.rangesfile.flush()
+            if done:
+                return
+
+    def closelog(self):
+        if self.logthread is None:
+            return
+        self.logqueue.put(None)
+        self.logthread.join()
+        self.logthread=None
+        self.logfile.close()
+        self.logfile=None
+        if self.rangesfile is not None:
+            self.rangesfile.close()
+            self.rangesfile=None
+
+    def stopworker(self):
+        if self.worker is not None:
+            self.worker.kill()
+            self.worker.wait()
+            self.worker=None
+
+    def sessionkey(self):
+        # Anything that would change the outcome of run()
+        h=hashlib.sha256(self.goldendata)
+        # A faulted executable gets rewritten, its golden content is already hashed
+        targetpath=shutil.which(self.targetbin) if self.targetbin is not None and not self.faultexec else None
+        if targetpath is not None:
+            h.update(struct.pack('<Q', os.stat(targetpath).st_mtime_ns))
+        if type(self.faults) is list:
+            faults=[(name, self.faulttable(fct)) for name, fct in self.faults]
+        else:
+            faults=self.faults
+        h.update(repr((self.iblock, faults, self.dfa.__name__, self.maxleaf, self.minleaf, self.minleafnail,
+            self.start_from_left, self.depth_first_traversal, self.minfaultspercol, self.outputbeforelastrounds,
+            self.lastroundkeys, self.encrypt)).encode())
+        h.update(b''.join([rangestruct.pack(*r) for r in self.tabletree]))
+        return h.hexdigest()
+
+    def sessionpath(self):
+        cachedir=os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'deadpool_dfa')
+        os.makedirs(cachedir, exist_ok=True)
+        return os.path.join(cachedir, self.sessionkey()+'.pkl')
+
+    def loadsession(self, path):
+        self.sessionfile=path
+        if not os.path.isfile(self.sessionfile):
+            return
+        with open(self.sessionfile, 'rb') as f:
+            state=pickle.load(f)
+        self.encpairs, self.decpairs=state['encpairs'], state['decpairs']
+        self.encknown, self.decknown=set(self.encpairs), set(self.decpairs)
+        self.encstatus, self.decstatus=state['encstatus'], state['decstatus']
+        self.tabletree=deque(state['tabletree'])
+        self.sessionsaved=len(self.encpairs)+len(self.decpairs)
+        if self.verbose>0:
+            print('Resuming session %s: %i ranges left' % (self.sessionfile, len(self.tabletree)))
+
+    def savesession(self):
+        state={'encpairs':self.encpairs, 'decpairs':self.decpairs,
+            'encstatus':self.encstatus, 'decstatus':self.decstatus,
+            'tabletree':list(self.tabletree)}
+        # Atomic replacement, not to lose the previous session if interrupted
+        with open(self.sessionfile+'.tmp', 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(self.sessionfile+'.tmp', self.sessionfile)
+        self.sessionsaved=len(self.encpairs)+len(self.decpairs)
+
+    def interruptsession(self):
+        if self.inflight is not None:
+            ranges, length=self.inflight
+            # Interrupted ranges get replayed entirely, dropping the subranges they already queued
+            for _ in range(len(self.tabletree)-length):
+                if self.start_from_left:
+                    self.tabletree.pop()
+                else:
+                    self.tabletree.popleft()
+            if self.start_from_left:
+                self.tabletree.extendleft(reversed(ranges))
+            else:
+                self.tabletree.extend(reversed(ranges))
+            self.inflight=None
+        self.savesession()
+
     def splitrange(self, r, mincut=1):
-        x,y=r
-        if y-x <= self.maxleaf and mincut == 0:
-            return deque([r])
-        # Let's split range into power of two and remaining
-        left=1<<(((y-x-1)//2)).bit_length()
-        if mincut>0:
-            mincut=mincut-1
-        dq=self.splitrange((x,x+left), mincut)
-        dq.extend(self.splitrange((x+left,y), mincut))
+        dq=deque()
+        # Ranges still to split, leftmost on top
+        stack=[(tuple(r), mincut)]
+        while stack:
+            (x,y), mincut=stack.pop()
+            if y-x <= self.maxleaf and mincut == 0:
+                dq.append((x,y))
+                continue
+            # Let's split range into power of two and remaining
+            left=1<<(((y-x-1)//2)).bit_length()
+            if mincut>0:
+                mincut=mincut-1
+            stack.append(((x+left,y), mincut))
+            stack.append(((x,x+left), mincut))
         return dq
 
     def inject(self, r, faultfct):
-        return self.goldendata[:r[0]]+bytes([faultfct(x) for x in self.goldendata[r[0]:r[1]]])+self.goldendata[r[1]:]
+        return b''.join((self.goldenview[:r[0]], self.goldendata[r[0]:r[1]].translate(self.faulttable(faultfct)), self.goldenview[r[1]:]))
+
+    def faulttable(self, faultfct):
+        if faultfct in self.faulttables:
+            return self.faulttables[faultfct]
+        return bytes([faultfct(x) for x in range(256)])
 
-    def dig(self, tree=None, faults=None, level=0, candidates=[]):
+    def faultlog(self, level, r, fault, oblock, status, index):
+        # Only built when printed or logged, most faults being neither
+        log='Lvl %03i [0x%08X-0x%08X[ %s 0x%02X %0*X ->' % (level, r[0], r[1], fault[0], fault[1](0), 2*self.blocksize, self.iblock)
+        if oblock is not None:
+            log+=' %0*X' % (2*self.blocksize, oblock)
+        log+=' '+status.name
+        if status in self.goodfaults:
+            log+=' Column:'+str(index)
+        return log
+
+    def dig(self, tree=None, faults=None, level=0, candidates=[], faultindex=0):
+        # With a list of faults, faultindex points to the one to try, rather than slicing the list
         if tree is None:
             tree=self.tabletree
         if faults is None:
@@ -287,118 +852,125 @@ class Acquisition:
         if not self.depth_first_traversal:
             breadth_first_level_address=None
         while len(tree)>0:
-            if type(faults) is list:
-                fault=faults[0]
-            else:
-                faultval = random.randint(1,255)
-                fault=('xor', lambda x: x ^ faultval)
-            if self.start_from_left:
-                r=tree.popleft()
-                if not self.depth_first_traversal:
-                    if breadth_first_level_address is not None and r[0] < breadth_first_level_address:
-                        level+=1
-                    breadth_first_level_address = r[0]
+            # Checkpoint between two top-level ranges, when nothing is in flight
+            if tree is self.tabletree:
+                self.inflight=None
+                if self.sessionfile is not None and len(self.encpairs)+len(self.decpairs) >= self.sessionsaved+100:
+                    self.savesession()
+            # Independent ranges are faulted concurrently, up to self.jobs at once
+            batch=[]
+            while len(tree)>0 and len(batch)<self.jobs:
+                if type(faults) is list:
+                    fault=faults[faultindex]
+                else:
+                    fault=self.xorfaults[random.randint(1,255)]
+                if self.start_from_left:
+                    r=tree.popleft()
+                    if not self.depth_first_traversal:
+                        if breadth_first_level_address is not None and r[0] < breadth_first_level_address:
+                            level+=1
+                        breadth_first_level_address = r[0]
+                else:
+                    r=tree.pop()
+                    if not self.depth_first_traversal:
+                        if breadth_first_level_address is not None and r[1] > breadth_first_level_address:
+                            level+=1
+                        breadth_first_level_address = r[1]
+                batch.append((r, fault, level))
+            if tree is self.tabletree:
+                self.inflight=([r for r, _, _ in batch], len(tree))
+            if len(batch)>1:
+                results=self.doit_batch([(r, fault[1]) for r, fault, _ in batch], self.processed_input)
             else:
-                r=tree.pop()
-                if not self.depth_first_traversal:
-                    if breadth_first_level_address is not None and r[1] > breadth_first_level_address:
-                        level+=1
-                    breadth_first_level_address = r[1]
-            table=self.inject(r, fault[1])
-            oblock,status,index=self.doit(table, self.processed_input)
-            log='Lvl %03i [0x%08X-0x%08X[ %s 0x%02X %0*X ->' % (level, r[0], r[1], fault[0], fault[1](0), 2*self.blocksize, self.iblock)
-            if oblock is not None:
-                log+=' %0*X' % (2*self.blocksize, oblock)
-            log+=' '+status.name
-            if status in [self.FaultStatus.GoodEncFault, self.FaultStatus.GoodDecFault]:
-                log+=' Column:'+str(index)
-            if self.verbose>1:
-                print(log)
-            if status in [self.FaultStatus.NoFault, self.FaultStatus.MinorFault]:
-                continue
-            elif status in [self.FaultStatus.GoodEncFault, self.FaultStatus.GoodDecFault]:
-                if status is self.FaultStatus.GoodEncFault and self.minfaultspercol is not None and self.encstatus[index] >= self.minfaultspercol:
-                    continue
-                if status is self.FaultStatus.GoodDecFault and self.minfaultspercol is not None and self.decstatus[index] >= self.minfaultspercol:
-                    continue
-                if r[1]>r[0]+self.minleafnail:
-                    # Nailing phase: always depth-first is ok
-                    if self.verbose>2:
-                        print('Nailing [0x%08X-0x%08X[' % (r[0], r[1]))
-                    del(table)
-                    if self.dig(self.splitrange(r), faults, level+1):
-                        return True
+                r, fault, _ = batch[0]
+                results=[self.doit_range(r, fault[1], self.processed_input)]
+            for (r, fault, level), (oblock,status,index) in zip(batch, results):
+                if self.verbose>1:
+                    print(self.faultlog(level, r, fault, oblock, status, index))
+                if status in self.nofaults:
                     continue
-                else:
-                    mycandidates=candidates+[(log, (self.iblock, oblock))]
-                    if type(faults) is list and len(faults)>1:
-                        del(table)
-                        if self.dig(deque([r]), faults[1:], level, mycandidates):
-                            return True
+                elif status in self.goodfaults:
+                    if status is self.FaultStatus.GoodEncFault and self.minfaultspercol is not None and self.encstatus[index] >= self.minfaultspercol:
                         continue
-                    elif type(faults) is int and faults>1:
-                        del(table)
-                        if self.dig(deque([r]), faults-1, level, mycandidates):
-                            return True
-                        continue
-                    else:
-                        while len(mycandidates)>0:
-                            txt,pair = mycandidates.pop(0)
-                            if self.verbose>0:
-                                print(txt+' Logged')
-                            if status is self.FaultStatus.GoodEncFault:
-                                if pair not in self.encpairs:
-                                    self.encpairs.append(pair)
-                                    self.encstatus[index]+=1
-                                if self.minfaultspercol is not None and [x for x in self.encstatus if x < self.minfaultspercol] == []:
-                                    return True
-                            else:
-                                if pair not in self.decpairs:
-                                    self.decpairs.append(pair)
-                                    self.decstatus[index]+=1
-                                if self.minfaultspercol is not None and [x for x in self.decstatus if x < self.minfaultspercol] == []:
-                                    return True
-                            self.logfile.write(txt+'\n')
-                        self.logfile.flush()
+                    if status is self.FaultStatus.GoodDecFault and self.minfaultspercol is not None and self.decstatus[index] >= self.minfaultspercol:
                         continue
-            elif status in [self.FaultStatus.MajorFault, self.FaultStatus.Loop, self.FaultStatus.Crash]:
-                if r[1]>r[0]+self.minleaf:
-                    if self.depth_first_traversal:
-                        del(table)
-                        if self.dig(self.splitrange(r), faults, level+1):
+                    if r[1]>r[0]+self.minleafnail:
+                        # Nailing phase: always depth-first is ok
+                        if self.verbose>2:
+                            print('Nailing [0x%08X-0x%08X[' % (r[0], r[1]))
+                        if self.dig(self.splitrange(r), faults, level+1, faultindex=faultindex):
                             return True
                         continue
-                    else: # breadth-first traversal
-                        if self.start_from_left:
-                            tree.extend(self.splitrange(r))
+                    else:
+                        mycandidates=candidates+[(self.faultlog(level, r, fault, oblock, status, index), (self.iblock, oblock), r)]
+                        if type(faults) is list and len(faults)>faultindex+1:
+                            if self.dig(deque([r]), faults, level, mycandidates, faultindex+1):
+                                return True
+                            continue
+                        elif type(faults) is int and faults>1:
+                            if self.dig(deque([r]), faults-1, level, mycandidates):
+                                return True
                             continue
                         else:
-                            tree.extendleft(reversed(self.splitrange(r)))
+                            while len(mycandidates)>0:
+                                txt,pair,rc = mycandidates.pop(0)
+                                if self.verbose>0:
+                                    print(txt+' Logged')
+                                if self.recordpair(status, index, pair):
+                                    return True
+                                self.log(txt, rc)
                             continue
-                else:
-                    continue
+                elif status in self.badfaults:
+                    if r[1]>r[0]+self.minleaf:
+                        if self.depth_first_traversal:
+                            if self.dig(self.splitrange(r), faults, level+1, faultindex=faultindex):
+                                return True
+                            continue
+                        else: # breadth-first traversal
+                            if self.start_from_left:
+                                tree.extend(self.splitrange(r))
+                                continue
+                            else:
+                                tree.extendleft(reversed(self.splitrange(r)))
+                                continue
+                    else:
+                        continue
         return False
 
+    def recordpair(self, status, index, pair):
+        # Returns True once all columns got minfaultspercol faults
+        if status is self.FaultStatus.GoodEncFault:
+            pairs, known, colstatus=self.encpairs, self.encknown, self.encstatus
+        else:
+            pairs, known, colstatus=self.decpairs, self.decknown, self.decstatus
+        if pair not in known:
+            known.add(pair)
+            pairs.append(pair)
+            colstatus[index]+=1
+        return self.minfaultspercol is not None and min(colstatus) >= self.minfaultspercol
+
     def run(self, lastroundkeys=[], encrypt=None):
         if encrypt is not None and self.encrypt is not None:
             assert self.encrypt==encrypt
         if encrypt is not None and self.encrypt is None:
             self.encrypt=encrypt
         self.lastroundkeys=lastroundkeys
-        if self.logfilename is None:
-            self.logfile=open('%s_%s.log' % (self.targetbin, self.inittimestamp), 'w')
-        else:
-            self.logfile=open(self.logfilename, 'w')
         if self.addresses is None:
             self.tabletree=deque(self.splitrange((0, len(self.goldendata))))
+        elif type(self.addresses) is str and self.addresses.endswith('.bin'):
+            with open(self.addresses, 'rb') as reflog:
+                self.tabletree=deque(rangestruct.iter_unpack(reflog.read()))
         elif type(self.addresses) is str:
-            self.tabletree=deque()
-            with open(self.addresses, 'r') as reflog:
-                for line in reflog:
-                    self.tabletree.extend([(int(line[9:19],16),int(line[20:30],16))])
+            with open(self.addresses, 'rb') as reflog:
+                self.tabletree=deque([(int(x,16),int(y,16)) for x,y in logranges.findall(reflog.read())])
         else:
             self.tabletree=deque(self.splitrange(self.addresses))
         self.processed_input=self.processinput(self.iblock, self.blocksize)
+        # Before the golden run, which may rewrite targetbin
+        sessionfile=self.sessionpath() if self.session else None
+        # Resumed sessions keep the entries logged so far
+        self.openlog(withranges=True, append=sessionfile is not None and os.path.isfile(sessionfile))
+        self.opentargetdata()
         # Prepare golden output
         starttime=time.time()
         oblock,status,index=self.doit(self.goldendata, self.processed_input, protect=False, init=True)
@@ -408,24 +980,37 @@ class Acquisition:
             raise AssertionError('Error, could not obtain golden output, check your setup!')
         self.encpairs=[(self.iblock, oblock)]
         self.decpairs=[(self.iblock, oblock)]
+        # Same pairs, for fast lookups
+        self.encknown=set(self.encpairs)
+        self.decknown=set(self.decpairs)
         self.encstatus=[0,0,0,0]
         self.decstatus=[0,0,0,0]
+        # Checkpoints count from this run's pairs, run() may be called repeatedly
+        self.sessionsaved=0
+        if sessionfile is not None:
+            self.loadsession(sessionfile)
         self.dig()
+        self.inflight=None
+        if self.sessionfile is not None:
+            # Done, even if dig() stopped early as all columns are filled
+            self.tabletree.clear()
+            self.savesession()
+            self.sessionfile=None
+        self.stopworker()
         tracefiles=self.savetraces()
-        os.remove(self.targetdata)
-        self.logfile.close()
+        self.removetargetdata()
+        self.closelog()
         return tracefiles
 
-    def digoninput(self, tree=None, faults=None, candidates=[], mimiclastround=True):
+    def digoninput(self, tree=None, faults=None, candidates=[], mimiclastround=True, faultindex=0):
         if tree is None:
             tree=list(range(16))
         if faults is None:
             faults=self.faults
         if type(faults) is list:
-            fault=faults[0]
+            fault=faults[faultindex]
         else:
-            faultval = random.randint(1,255)
-            fault=('xor', lambda x: x ^ faultval)
+            fault=self.xorfaults[random.randint(1,255)]
         table=self.goldendata
 
         while len(tree)>0:
@@ -443,20 +1028,20 @@ class Acquisition:
             if oblock is not None:
                 log+=' %0*X' % (2*self.blocksize, oblock)
             log+=' '+status.name
-            if status in [self.FaultStatus.GoodEncFault, self.FaultStatus.GoodDecFault]:
+            if status in self.goodfaults:
                 log+=' Column:'+str(index)
             if self.verbose>1:
                 print(log)
-            if status in [self.FaultStatus.NoFault, self.FaultStatus.MinorFault]:
+            if status in self.nofaults:
                 continue
-            elif status in [self.FaultStatus.GoodEncFault, self.FaultStatus.GoodDecFault]:
+            elif status in self.goodfaults:
                 if status is self.FaultStatus.GoodEncFault and self.minfaultspercol is not None and self.encstatus[index] >= self.minfaultspercol:
                     continue
                 if status is self.FaultStatus.GoodDecFault and self.minfaultspercol is not None and self.decstatus[index] >= self.minfaultspercol:
                     continue
-                mycandidates=candidates+[(log, (iblock, oblock))]
-                if type(faults) is list and len(faults)>1:
-                    if self.digoninput([i], faults[1:], mycandidates):
+                mycandidates=candidates+[(log, (iblock, oblock), None)]
+                if type(faults) is list and len(faults)>faultindex+1:
+                    if self.digoninput([i], faults, mycandidates, faultindex=faultindex+1):
                         return True
                     continue
                 elif type(faults) is int and faults>1:
@@ -465,25 +1050,14 @@ class Acquisition:
                     continue
                 else:
                     while len(mycandidates)>0:
-                        txt,pair = mycandidates.pop(0)
+                        txt,pair,_ = mycandidates.pop(0)
                         if self.verbose>0:
                             print(txt+' Logged')
-                        if status is self.FaultStatus.GoodEncFault:
-                            if pair not in self.encpairs:
-                                self.encpairs.append(pair)
-                                self.encstatus[index]+=1
-                            if self.minfaultspercol is not None and [x for x in self.encstatus if x < self.minfaultspercol] == []:
-                                return True
-                        else:
-                            if pair not in self.decpairs:
-                                self.decpairs.append(pair)
-                                self.decstatus[index]+=1
-                            if self.minfaultspercol is not None and [x for x in self.decstatus if x < self.minfaultspercol] == []:
-                                return True
-                        self.logfile.write(txt+'\n')
-                    self.logfile.flush()
+                        if self.recordpair(status, index, pair):
+                            return True
+                        self.log(txt)
                     continue
-            elif status in [self.FaultStatus.MajorFault, self.FaultStatus.Loop, self.FaultStatus.Crash]:
+            elif status in self.badfaults:
                 continue
         return False
 
@@ -493,10 +1067,7 @@ class Acquisition:
         if encrypt is not None and self.encrypt is None:
             self.encrypt=encrypt
         self.lastroundkeys=lastroundkeys
-        if self.logfilename is None:
-            self.logfile=open('%s_%s.log' % (self.targetbin, self.inittimestamp), 'w')
-        else:
-            self.logfile=open(self.logfilename, 'w')
+        self.openlog()
         # Prepare golden output
         starttime=time.time()
         iblock=self.iblock
@@ -505,9 +1076,12 @@ class Acquisition:
             iblock = self.dfa.MC(iblock)
             iblock = self.dfa.bytes2int(iblock)
         processed_input=self.processinput(iblock, self.blocksize)
+        self.opentargetdata()
         oblock,status,index=self.doit(self.goldendata, processed_input, protect=False, init=True)
         self.encpairs=[(iblock, oblock)]
         self.decpairs=[(iblock, oblock)]
+        self.encknown=set(self.encpairs)
+        self.decknown=set(self.decpairs)
         # Set timeout = N times normal execution time
         self.timeout=(time.time()-starttime)*self.timeoutfactor
         if oblock is None or status is not self.FaultStatus.NoFault:
@@ -515,7 +1089,8 @@ class Acquisition:
         self.encstatus=[0,0,0,0]
         self.decstatus=[0,0,0,0]
         self.digoninput(mimiclastround=mimiclastround)
+        self.stopworker()
         tracefiles=self.savetraces()
-        os.remove(self.targetdata)
-        self.logfile.close()
+        self.removetargetdata()
+        self.closelog()
         return tracefiles